@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+
+class MLBatcher:
+    """
+    Coalesce concurrent ML scoring calls into a single matrix product.
+
+    Callers await score(row) with one feature vector. Requests are counted
+    with track(); while fewer than min_concurrency are in flight, score()
+    runs inline so a lone request never waits. Otherwise a background task
+    collects queued rows until every in-flight request has queued one, or
+    max_batch rows, or max_wait_ms after the first, scores them in one call
+    and resolves each caller's future.
+    """
+
+    def __init__(
+        self,
+        score_rows: Callable[[np.ndarray], np.ndarray],
+        score_one: Callable[[np.ndarray], float],
+        max_batch: int = 32,
+        max_wait_ms: float = 2.0,
+        min_concurrency: int = 2,
+    ):
+        self.score_rows = score_rows
+        self.score_one = score_one
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.min_concurrency = min_concurrency
+        self.in_flight = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._changed: Optional[asyncio.Event] = None  # a row was queued or a request finished
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running or self.max_batch <= 1:
+            return
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @contextlib.contextmanager
+    def track(self):
+        """Count a request as in flight (and a possible batch member) while the block runs."""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self._changed is not None:
+                self._changed.set()
+
+    async def score(self, row: np.ndarray) -> float:
+        # not started (batching disabled, called outside the app) or nothing to
+        # batch with: score inline rather than wait for rows that won't come
+        if not self.running or self.in_flight < self.min_concurrency:
+            return self.score_one(row)
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, fut))
+        self._changed.set()
+        return await fut
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        # stop as soon as every request still in flight has queued its row
+        while len(batch) < min(self.max_batch, self.in_flight):
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                if len(batch) == 1:
+                    scores = [self.score_one(batch[0][0])]
+                else:
+                    scores = self.score_rows(np.stack([row for row, _ in batch]))
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), s in zip(batch, scores):
+                if not fut.done():
+                    fut.set_result(float(s))
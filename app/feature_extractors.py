@@ -1,20 +1,146 @@
 import re
-import textdistance
-from typing import List, Set
+import threading
+from functools import lru_cache
+import ahocorasick
+from rapidfuzz.distance import JaroWinkler
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple, Union
+
+try:
+    import hyperscan
+except ImportError:  # optional; rule terms are matched with Aho-Corasick instead
+    hyperscan = None
 
 SCAM_TERMS = {"otp", "one-time password", "seed", "seed phrase", "recovery phrase", "private key"}
 URGENCY = {"urgent", "immediately", "within 10 minutes", "within 5 minutes"}
 SECRECY = {"don't tell", "confidential", "keep this between us"}
 
-def contains_any(text: str, terms: Set[str]) -> List[str]:
+# Keywords behind the has_otp / has_seed / has_urgent ML features; the rule
+# engine registers them in its matcher so one scan serves rules and ML
+ML_TERMS: Dict[str, Set[str]] = {
+    "otp": {"otp", "one-time password"},
+    "seed": {"seed phrase", "private key", "recovery phrase"},
+    "urgent": {"urgent", "immediately"},
+}
+
+def _tags_by_term(tagged_terms: Dict[str, Iterable[str]]) -> Dict[str, frozenset]:
+    # lowercased once here, at build time; scanned text is always lowercase
+    grouped: Dict[str, Set[str]] = {}
+    for tag, terms in tagged_terms.items():
+        for term in terms:
+            term = term.lower()
+            if term:
+                grouped.setdefault(term, set()).add(tag)
+    return {term: frozenset(tags) for term, tags in grouped.items()}
+
+def build_automaton(tagged_terms: Dict[str, Iterable[str]]) -> ahocorasick.Automaton:
+    """Build one Aho-Corasick automaton over every term, remembering which tags each term belongs to."""
+    ac = ahocorasick.Automaton()
+    for term, tags in _tags_by_term(tagged_terms).items():
+        ac.add_word(term, (term, tags))
+    ac.make_automaton()
+    return ac
+
+class HyperscanMatcher:
+    """Block-mode Hyperscan literal database over the same tagged terms as build_automaton()."""
+
+    def __init__(self, tagged_terms: Dict[str, Iterable[str]]):
+        self.entries: List[Tuple[str, frozenset]] = list(_tags_by_term(tagged_terms).items())
+        n = len(self.entries)
+        self.db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        self.db.compile(
+            expressions=[term.encode("utf-8") for term, _ in self.entries],
+            ids=list(range(n)),
+            elements=n,
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH] * n,
+            literal=True,
+        )
+        self._local = threading.local()  # scratch space cannot be shared between concurrent scans
+
+    def scan(self, text_lower: str) -> Dict[str, List[str]]:
+        found: Dict[str, List[str]] = {}
+        if not text_lower:
+            return found
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None:
+            scratch = self._local.scratch = hyperscan.Scratch(self.db)
+        entries = self.entries
+        def on_match(idx, start, end, flags, context):
+            term, tags = entries[idx]
+            for tag in tags:
+                found.setdefault(tag, []).append(term)
+        self.db.scan(text_lower.encode("utf-8"), match_event_handler=on_match, scratch=scratch)
+        return found
+
+TermMatcher = Union[HyperscanMatcher, ahocorasick.Automaton]
+
+def build_matcher(tagged_terms: Dict[str, Iterable[str]]) -> TermMatcher:
+    """Use Hyperscan when it is installed and there is something to match, else Aho-Corasick."""
+    if hyperscan is not None and any(tagged_terms.values()):
+        try:
+            return HyperscanMatcher(tagged_terms)
+        except hyperscan.error:
+            pass
+    return build_automaton(tagged_terms)
+
+def scan_terms(text_lower: str, matcher: TermMatcher) -> Dict[str, List[str]]:
+    """Single pass over already-lowercased text; returns tag -> matched terms in order of appearance."""
+    if isinstance(matcher, HyperscanMatcher):
+        return matcher.scan(text_lower)
+    found: Dict[str, List[str]] = {}
+    if not text_lower or matcher.kind != ahocorasick.AHOCORASICK:
+        return found
+    seen: Set[str] = set()
+    for _, (term, tags) in matcher.iter(text_lower):
+        if term in seen:
+            continue
+        seen.add(term)
+        for tag in tags:
+            found.setdefault(tag, []).append(term)
+    return found
+
+def build_context(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize an event once per request; rule predicates and ML features read from this."""
+    text = event.get("text") or ""
+    return {
+        "text": text,
+        "text_lower": text.lower(),
+        "display": (event.get("display_domain") or "").lower(),
+        "final": (event.get("final_domain") or "").lower(),
+        "sender": event.get("sender") or {},
+        "reputation": event.get("reputation") or {},
+    }
+
+def as_context(event: Dict[str, Any]) -> Dict[str, Any]:
+    return event if "text_lower" in event else build_context(event)
+
+def contains_any(text: str, terms: FrozenSet[str]) -> List[str]:
+    """Terms found in text; terms must already be lowercase (lowercase them once, when building the set)."""
     t = (text or "").lower()
-    return [term for term in terms if term.lower() in t]
+    return [term for term in terms if term in t]
+
+# Longest valid DNS name; longer inputs are not real hostnames and are not memoized
+MAX_HOSTNAME_LEN = 253
+
+@lru_cache(maxsize=4096)
+def _cached_similarity(a_lower: str, b_lower: str) -> float:
+    return JaroWinkler.similarity(a_lower, b_lower)
+
+def domain_similarity(a_lower: str, b_lower: str) -> float:
+    """Jaro-Winkler similarity of two already-lowercased domains; hostname-sized pairs repeat a lot, so they are memoized."""
+    if not a_lower or not b_lower:
+        return 0.0
+    if a_lower == b_lower:
+        return 1.0
+    # request strings are unbounded; don't let the cache keep oversized ones alive
+    if len(a_lower) > MAX_HOSTNAME_LEN or len(b_lower) > MAX_HOSTNAME_LEN:
+        return JaroWinkler.similarity(a_lower, b_lower)
+    return _cached_similarity(a_lower, b_lower)
 
 def lookalike_score(a: str, b: str) -> float:
     # Use Jaro-Winkler similarity as a reasonable proxy
     if not a or not b:
         return 0.0
-    return float(textdistance.jaro_winkler(a.lower(), b.lower()))
+    return domain_similarity(a.lower(), b.lower())
 
 def regex_match(text: str, pattern: str) -> bool:
     if not text:
@@ -1,15 +1,21 @@
+import math
 import os
 import pickle
+import threading
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List
+
+import numpy as np
 
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
-from .models import Event, DetectResponse, RuleHit
-from .rules import RuleEngine, diminishing_sum, map_to_tier, blend_scores
+from .models import Event, DetectResponse
+from .rules import RuleEngine, map_to_tier, blend_scores
+from .feature_extractors import as_context, build_context
+from .batching import MLBatcher
 
 # ------------------------------------------------------------------
 #  Configuration
@@ -18,19 +24,24 @@ RULES_PATH = os.getenv(
     "RULES_PATH",
     os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules", "rules.yaml")
 )
+# Where the parsed-rules cache is written; defaults to next to the YAML file
+RULES_CACHE_DIR = os.getenv("RULES_CACHE_DIR") or None
 MODEL_PATH = os.getenv(
     "MODEL_PATH",
     os.path.join(os.path.dirname(__file__), "model.pkl")
 )
+# Weights-only export written by scripts/train_model.py; preferred over the pickle
+MODEL_NPZ_PATH = os.getenv("MODEL_NPZ_PATH", os.path.splitext(MODEL_PATH)[0] + ".npz")
 ALPHA = float(os.getenv("BLEND_ALPHA", "0.7"))  # expert weight
+ML_DEBUG = os.getenv("ML_DEBUG", "0") == "1"  # score through sklearn predict_proba
+WARMUP = os.getenv("WARMUP", "1") == "1"  # run a synthetic event through the engine at startup
+# Micro-batching of concurrent ML scoring calls; ML_BATCH_SIZE=1 disables it
+ML_BATCH_SIZE = int(os.getenv("ML_BATCH_SIZE", "32"))
+ML_BATCH_WAIT_MS = float(os.getenv("ML_BATCH_WAIT_MS", "2"))
+# Below this many concurrent requests ML scoring runs inline, with no batching delay
+ML_BATCH_MIN_CONCURRENCY = int(os.getenv("ML_BATCH_MIN_CONCURRENCY", "2"))
 
-app = FastAPI(title="Scam Expert System", version="1.0.0")
-
-# Mount /static for optional images/js/css
-#app.mount(
-#    "/static",
-#    name="static",
-#)
+app = FastAPI(title="Scam Expert System", version="1.0.0", default_response_class=ORJSONResponse)
 
 # ------------------------------------------------------------------
 #  Templates
@@ -51,218 +62,116 @@ ACTION_DESCRIPTIONS = {
     "escalate_manual_review": "Send the case to a human reviewer for manual inspection.",
 }
 
+# Internal action codes per tier
+TIER_TO_CODES = {
+    "T0": ("allow",),
+    "T1": ("warn_user", "log"),
+    "T2": ("strong_warn", "limit_actions", "request_verification"),
+    "T3": ("block", "escalate_manual_review"),
+}
+TIER_TO_FRIENDLY = {
+    tier: tuple(ACTION_DESCRIPTIONS.get(a, a) for a in codes)
+    for tier, codes in TIER_TO_CODES.items()
+}
+
 # ------------------------------------------------------------------
 #  Core Engine + ML Model
 # ------------------------------------------------------------------
-engine = RuleEngine(RULES_PATH)
-_ml_model = None
-_ml_ready = False
-
-if os.path.exists(MODEL_PATH):
-    try:
-        with open(MODEL_PATH, "rb") as f:
-            _ml_model = pickle.load(f)
-            _ml_ready = True
-    except Exception:
-        _ml_ready = False
+engine = RuleEngine(RULES_PATH, cache_dir=RULES_CACHE_DIR)
+_ml_model = None   # full pickle; only loaded for ML_DEBUG or when no .npz exists
+_ml_ready = False  # model loaded and usable
+_ml_warm = False   # load has been attempted (lazily, on first use)
+_ml_lock = threading.Lock()
+
+# One extractor per ML feature; each takes the request context and its term hits
+_FEATURES: Dict[str, Callable[[Dict[str, Any], Dict[str, List[str]]], float]] = {
+    "len_text": lambda c, found: len(c["text"]),
+    "has_otp": lambda c, found: "otp" in found,
+    "has_seed": lambda c, found: "seed" in found,
+    "has_urgent": lambda c, found: "urgent" in found,
+    "url_mismatch": lambda c, found: c["display"] != c["final"],
+    "domain_age": lambda c, found: c["sender"].get("domain_age_days") or 9999,
+    "reports": lambda c, found: c["reputation"].get("reports_last_90d") or 0,
+    "blacklisted": lambda c, found: bool(c["reputation"].get("global_blacklist", False)),
+}
 
-# ------------------------------------------------------------------
-#  UI Routes
-# ------------------------------------------------------------------
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request):
-    """
-    Render the landing page with a textarea form
-    for message analysis.
-    """
-    return templates.TemplateResponse("index.html", {"request": request})
+# Logistic regression unpacked for the fast path: sigmoid(x @ _W + _b)
+_FEATURE_FILL: List[Callable[[Dict[str, Any], Dict[str, List[str]]], float]] = []
+_W = np.zeros(0, np.float32)
+_b = 0.0
+_local = threading.local()  # per-thread feature buffer (sync routes run in a threadpool)
 
 
-@app.post("/analyze", response_class=HTMLResponse)
-async def analyze_message(
-    request: Request,
-    message: str = Form(...)
-):
+def _load_model() -> bool:
     """
-    Handle form submissions from the UI.
-    Uses the same detect logic as the /detect API,
-    but returns an HTML page with the result.
+    Load the ML model on first use rather than at import, so worker boot
+    stays cheap. Returns whether ML scoring is available.
     """
-    event = {"text": message}
-    hits, hard_stop = engine.apply(event)
-    expert_score = diminishing_sum([h["weight"] for h in hits])
-
-    score = 100.0 if hard_stop else expert_score
-    ml = ml_score(event) if not hard_stop else 100.0
-    if _ml_ready and not hard_stop:
-        score = blend_scores(expert_score, ml, ALPHA)
-
-    tier = "T3" if hard_stop else map_to_tier(score)
-
-    # internal action codes
-    action_codes = {
-        "T0": ["allow"],
-        "T1": ["warn_user", "log"],
-        "T2": ["strong_warn", "limit_actions", "request_verification"],
-        "T3": ["block", "escalate_manual_review"],
-    }[tier]
-
-    # convert to human-friendly descriptions
-    friendly_actions = [ACTION_DESCRIPTIONS.get(a, a) for a in action_codes]
-
-    summary = f"Score {score:.1f} → {tier}. Expert={expert_score:.1f}" + (
-        f", ML={ml:.1f}" if _ml_ready else ""
-    )
-
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "result": {
-                "score": round(score, 1),
-                "tier": tier,
-                "actions": friendly_actions,
-                "summary": summary,
-                "hits": hits[:5],
-            },
-        },
-    )
+    global _ml_model, _ml_ready, _ml_warm, _FEATURE_FILL, _W, _b
+    if _ml_warm:
+        return _ml_ready
+    with _ml_lock:
+        if _ml_warm:
+            return _ml_ready
+        try:
+            has_pkl = os.path.exists(MODEL_PATH)
+            # ML_DEBUG wants predict_proba from the pickle, but the npz still serves without it
+            if os.path.exists(MODEL_NPZ_PATH) and not (ML_DEBUG and has_pkl):
+                with np.load(MODEL_NPZ_PATH) as data:
+                    order = [str(k) for k in data["order"]]
+                    coef, intercept = data["coef"], data["intercept"]
+            elif has_pkl:
+                with open(MODEL_PATH, "rb") as f:
+                    _ml_model = pickle.load(f)
+                order = _ml_model["feature_order"]
+                coef, intercept = _ml_model["clf"].coef_, _ml_model["clf"].intercept_
+            else:
+                order = None
+            if order is not None:
+                _FEATURE_FILL = [_FEATURES[k] for k in order]
+                _W = np.asarray(coef[0], dtype=np.float32)
+                _b = float(intercept[0])
+                _ml_ready = True
+        except Exception:
+            _ml_ready = False
+        _ml_warm = True
+    return _ml_ready
 
 # ------------------------------------------------------------------
-#  API Routes
+#  Startup warm-up
 # ------------------------------------------------------------------
-@app.get("/health")
-def health():
-    return {"ok": True, "ml_loaded": _ml_ready}
-
-
-@app.get("/rules")
-def get_rules():
-    return engine.rules
-
-
-@app.post("/rules/reload")
-def reload_rules():
-    engine.load_rules()
-    return {"reloaded": True, "count": len(engine.rules)}
-
-
-@app.post("/detect", response_model=DetectResponse)
-def detect(event: Event):
-    e = event.model_dump()
-    hits, hard_stop = engine.apply(e)
-    expert_score = diminishing_sum([h["weight"] for h in hits])
-
-    score = 100.0 if hard_stop else expert_score
-    ml = ml_score(e) if not hard_stop else 100.0
-    if _ml_ready and not hard_stop:
-        score = blend_scores(expert_score, ml, ALPHA)
-
-    tier = "T3" if hard_stop else map_to_tier(score)
-    action_codes = {
-        "T0": ["allow"],
-        "T1": ["warn_user", "log"],
-        "T2": ["strong_warn", "limit_actions", "request_verification"],
-        "T3": ["block", "escalate_manual_review"],
-    }[tier]
-
-    # keep API response with internal codes (not the friendly text)
-    summary = f"Score {score:.1f} → {tier}. Expert={expert_score:.1f}" + (
-        f", ML={ml:.1f}" if _ml_ready else ""
-    )
-
-    return DetectResponse(
-        score=round(score, 1),
-        tier=tier,
-        rule_hits=[RuleHit(**h) for h in hits[:5]],
-        actions=action_codes,
-        summary=summary,
-    )
-
-# ------------------------------------------------------------------
-#  Helper Functions
-# ------------------------------------------------------------------
-def featurize_for_ml(event: Dict[str, Any]) -> Dict[str, Any]:
-    text = (event.get("text") or "").lower()
-    return {
-        "len_text": len(text),
-        "has_otp": int("otp" in text or "one-time password" in text),
-        "has_seed": int("seed phrase" in text or "private key" in text or "recovery phrase" in text),
-        "has_urgent": int("urgent" in text or "immediately" in text),
-        "url_mismatch": int((event.get("display_domain") or "") != (event.get("final_domain") or "")),
-        "domain_age": int(event.get("sender", {}).get("domain_age_days") or 9999),
-        "reports": int(event.get("reputation", {}).get("reports_last_90d") or 0),
-        "blacklisted": int(bool(event.get("reputation", {}).get("global_blacklist", False))),
-    }
-
-
-def ml_score(event: Dict[str, Any]) -> float:
-    if not _ml_ready or _ml_model is None:
-        return 0.0
-    feats = featurize_for_ml(event)
-    xs = [[feats[k] for k in _ml_model["feature_order"]]]
-    p = _ml_model["clf"].predict_proba(xs)[0][1]
-    return float(p) * 100.0
-import os
-import pickle
-from pathlib import Path
-from typing import Dict, Any
-
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
+# Touches every rule category (term scan, regexes, domain mismatch/lookalike,
+# sender and reputation checks) so the first real request doesn't pay for the
+# lazy model load, RE2/numba compilation or the cold lookalike cache. Per-thread
+# state (Hyperscan scratch, the ML feature buffer) is still allocated by each
+# threadpool worker on its first request.
+_WARMUP_EVENT = {
+    "text": "URGENT: send your OTP to verify your account at https://bit.ly/x, keep this confidential.",
+    "display_domain": "support.paypai.com",
+    "final_domain": "support.paypal.com",
+    "sender": {"domain_age_days": 3, "confirmed_mule": False},
+    "reputation": {"reports_last_90d": 0, "global_blacklist": False},
+}
 
-from .models import Event, DetectResponse, RuleHit
-from .rules import RuleEngine, map_to_tier, blend_scores
 
-# ------------------------------------------------------------------
-#  Configuration
-# ------------------------------------------------------------------
-RULES_PATH = os.getenv(
-    "RULES_PATH",
-    os.path.join(os.path.dirname(os.path.dirname(__file__)), "rules", "rules.yaml")
-)
-MODEL_PATH = os.getenv(
-    "MODEL_PATH",
-    os.path.join(os.path.dirname(__file__), "model.pkl")
-)
-ALPHA = float(os.getenv("BLEND_ALPHA", "0.7"))  # expert weight
+def _warm_up():
+    # runs in the threadpool, where requests evaluate rules
+    ctx = build_context(_WARMUP_EVENT)
+    engine.apply(ctx)
+    if _load_model():
+        ml_score(ctx)
 
-app = FastAPI(title="Scam Expert System", version="1.0.0")
 
-# ------------------------------------------------------------------
-#  Templates
-# ------------------------------------------------------------------
-templates = Jinja2Templates(directory=Path(__file__).parent.parent / "templates")
+@app.on_event("startup")
+async def startup():
+    if WARMUP:
+        await run_in_threadpool(_warm_up)
+    _batcher.start()
 
-# ------------------------------------------------------------------
-#  Friendly action descriptions
-# ------------------------------------------------------------------
-ACTION_DESCRIPTIONS = {
-    "allow": "Allow the message — No risk detected.",
-    "warn_user": "Show a simple warning to the user.",
-    "log": "Log the event for monitoring.",
-    "strong_warn": "Display a strong fraud warning to the user.",
-    "limit_actions": "Limit account actions until the user is verified.",
-    "request_verification": "Ask the user to verify their identity.",
-    "block": "Block the message or transaction completely.",
-    "escalate_manual_review": "Send the case to a human reviewer for manual inspection.",
-}
 
-# ------------------------------------------------------------------
-#  Core Engine + ML Model
-# ------------------------------------------------------------------
-engine = RuleEngine(RULES_PATH)
-_ml_model = None
-_ml_ready = False
-
-if os.path.exists(MODEL_PATH):
-    try:
-        with open(MODEL_PATH, "rb") as f:
-            _ml_model = pickle.load(f)
-            _ml_ready = True
-    except Exception:
-        _ml_ready = False
+@app.on_event("shutdown")
+async def shutdown():
+    await _batcher.stop()
 
 # ------------------------------------------------------------------
 #  UI Routes
@@ -277,29 +186,26 @@ async def analyze_message(
     request: Request,
     message: str = Form(...)
 ):
-    event = {"text": message}
-    result = engine.apply(event)
+    event = build_context({"text": message})
+    # counted while in flight so concurrent requests' ML rows can be batched
+    with _batcher.track():
+        # rule evaluation is CPU-bound; keep it off the event loop
+        result = await run_in_threadpool(engine.apply, event)
+        hard_stop = result["hard_stop"]
+        ml_ready = _load_model()
+        ml = await ml_score_async(event) if not hard_stop else 100.0
 
     hits = result["hits"]
-    hard_stop = result["hard_stop"]
     expert_score = result["score"]
-
     score = 100.0 if hard_stop else expert_score
-    ml = ml_score(event) if not hard_stop else 100.0
-    if _ml_ready and not hard_stop:
+    if ml_ready and not hard_stop:
         score = blend_scores(expert_score, ml, ALPHA)
 
     tier = "T3" if hard_stop else map_to_tier(score)
-    action_codes = {
-        "T0": ["allow"],
-        "T1": ["warn_user", "log"],
-        "T2": ["strong_warn", "limit_actions", "request_verification"],
-        "T3": ["block", "escalate_manual_review"],
-    }[tier]
-    friendly_actions = [ACTION_DESCRIPTIONS.get(a, a) for a in action_codes]
+    friendly_actions = TIER_TO_FRIENDLY[tier]
 
     summary = f"Score {score:.1f} → {tier}. Expert={expert_score:.1f}" + (
-        f", ML={ml:.1f}" if _ml_ready else ""
+        f", ML={ml:.1f}" if ml_ready else ""
     )
 
     return templates.TemplateResponse(
@@ -321,7 +227,8 @@ async def analyze_message(
 # ------------------------------------------------------------------
 @app.get("/health")
 def health():
-    return {"ok": True, "ml_loaded": _ml_ready}
+    # ml_warm is False until the first request (or warm-up) triggers the lazy load
+    return {"ok": True, "ml_loaded": _ml_ready, "ml_warm": _ml_warm}
 
 
 @app.get("/rules")
@@ -335,61 +242,102 @@ def reload_rules():
     return {"reloaded": True, "count": len(engine.rules)}
 
 
-@app.post("/detect", response_model=DetectResponse)
-def detect(event: Event):
-    e = event.model_dump()
-    result = engine.apply(e)
+# The response is assembled from trusted engine output, so it is built as a
+# plain dict and serialized with orjson without re-validation (or FastAPI's
+# jsonable_encoder pass); tests check it against DetectResponse.
+@app.post("/detect", response_model=None, responses={200: {"model": DetectResponse}})
+async def detect(event: Event):
+    e = build_context(event.model_dump())
+    # counted while in flight so concurrent requests' ML rows can be batched
+    with _batcher.track():
+        # rule evaluation is CPU-bound; keep it off the event loop
+        result = await run_in_threadpool(engine.apply, e)
+        hard_stop = result["hard_stop"]
+        ml_ready = _load_model()
+        ml = await ml_score_async(e) if not hard_stop else 100.0
 
     hits = result["hits"]
-    hard_stop = result["hard_stop"]
     expert_score = result["score"]
-
     score = 100.0 if hard_stop else expert_score
-    ml = ml_score(e) if not hard_stop else 100.0
-    if _ml_ready and not hard_stop:
+    if ml_ready and not hard_stop:
         score = blend_scores(expert_score, ml, ALPHA)
 
     tier = "T3" if hard_stop else map_to_tier(score)
-    action_codes = {
-        "T0": ["allow"],
-        "T1": ["warn_user", "log"],
-        "T2": ["strong_warn", "limit_actions", "request_verification"],
-        "T3": ["block", "escalate_manual_review"],
-    }[tier]
 
     summary = f"Score {score:.1f} → {tier}. Expert={expert_score:.1f}" + (
-        f", ML={ml:.1f}" if _ml_ready else ""
+        f", ML={ml:.1f}" if ml_ready else ""
     )
 
-    return DetectResponse(
-        score=round(score, 1),
-        tier=tier,
-        rule_hits=[RuleHit(**h) for h in hits[:5]],
-        actions=action_codes,
-        summary=summary,
-    )
+    return ORJSONResponse(content={
+        "score": round(score, 1),
+        "tier": tier,
+        "rule_hits": hits[:5],
+        "actions": list(TIER_TO_CODES[tier]),
+        "summary": summary,
+    })
 
 # ------------------------------------------------------------------
 #  Helper Functions
 # ------------------------------------------------------------------
+def _term_hits(ctx: Dict[str, Any]) -> Dict[str, List[str]]:
+    # reuse the scan engine.apply() already did; only scan here for standalone calls
+    hits = ctx.get("term_hits")
+    return hits if hits is not None else engine.scan(ctx)
+
+
 def featurize_for_ml(event: Dict[str, Any]) -> Dict[str, Any]:
-    text = (event.get("text") or "").lower()
-    return {
-        "len_text": len(text),
-        "has_otp": int("otp" in text or "one-time password" in text),
-        "has_seed": int("seed phrase" in text or "private key" in text or "recovery phrase" in text),
-        "has_urgent": int("urgent" in text or "immediately" in text),
-        "url_mismatch": int((event.get("display_domain") or "") != (event.get("final_domain") or "")),
-        "domain_age": int(event.get("sender", {}).get("domain_age_days") or 9999),
-        "reports": int(event.get("reputation", {}).get("reports_last_90d") or 0),
-        "blacklisted": int(bool(event.get("reputation", {}).get("global_blacklist", False))),
-    }
+    ctx = as_context(event)
+    found = _term_hits(ctx)
+    return {k: int(fn(ctx, found)) for k, fn in _FEATURES.items()}
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    ez = math.exp(z)
+    return ez / (1.0 + ez)
+
+
+def _fill_features(ctx: Dict[str, Any], out: np.ndarray) -> np.ndarray:
+    found = _term_hits(ctx)
+    for i, fill in enumerate(_FEATURE_FILL):
+        out[i] = fill(ctx, found)
+    return out
+
+
+def _score_row(x: np.ndarray) -> float:
+    return _sigmoid(float(x @ _W) + _b) * 100.0
+
+
+def _score_rows(xs: np.ndarray) -> np.ndarray:
+    z = (xs @ _W).astype(np.float64) + _b
+    return 50.0 * (1.0 + np.tanh(0.5 * z))  # 100 * sigmoid(z) without exp overflow
+
+
+_batcher = MLBatcher(_score_rows, _score_row, ML_BATCH_SIZE, ML_BATCH_WAIT_MS, ML_BATCH_MIN_CONCURRENCY)
 
 
 def ml_score(event: Dict[str, Any]) -> float:
-    if not _ml_ready or _ml_model is None:
+    if not _load_model():
+        return 0.0
+    if ML_DEBUG and _ml_model is not None:
+        feats = featurize_for_ml(event)
+        xs = [[feats[k] for k in _ml_model["feature_order"]]]
+        p = _ml_model["clf"].predict_proba(xs)[0][1]
+        return float(p) * 100.0
+
+    buf = getattr(_local, "buf", None)
+    if buf is None:
+        buf = _local.buf = np.empty(len(_FEATURE_FILL), np.float32)
+    return _score_row(_fill_features(as_context(event), buf))
+
+
+async def ml_score_async(event: Dict[str, Any]) -> float:
+    """ml_score for async routes; concurrent calls are batched into one matrix product."""
+    if not _load_model():
         return 0.0
-    feats = featurize_for_ml(event)
-    xs = [[feats[k] for k in _ml_model["feature_order"]]]
-    p = _ml_model["clf"].predict_proba(xs)[0][1]
-    return float(p) * 100.0
+    if ML_DEBUG and _ml_model is not None:
+        return ml_score(event)
+    # each queued request needs its own row, so no shared buffer here
+    row = _fill_features(as_context(event), np.empty(len(_FEATURE_FILL), np.float32))
+    return await _batcher.score(row)
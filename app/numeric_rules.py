@@ -0,0 +1,128 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # optional; RuleEngine only uses the kernel when numba is present
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+# Op codes double as indexes into the feature vector built by numeric_features()
+OP_DOMAIN_AGE_LT = 0
+OP_REPORTS_GTE = 1
+OP_BLACKLIST_EQ = 2
+OP_MULE_EQ = 3
+OP_URL_MISMATCH = 4
+N_FEATURES = 5
+
+# condition key -> (op code, threshold from the YAML value)
+NUMERIC_CONDITIONS = {
+    "sender.domain_age_lt_days": (OP_DOMAIN_AGE_LT, lambda v: int(v)),
+    "reputation.reports_last_90d_gte": (OP_REPORTS_GTE, lambda v: int(v)),
+    "reputation.global_blacklist": (OP_BLACKLIST_EQ, lambda v: float(bool(v))),
+    "sender.confirmed_mule": (OP_MULE_EQ, lambda v: float(bool(v))),
+    "url.display_domain_neq_final": (OP_URL_MISMATCH, lambda v: 1.0),
+}
+
+Leaf = Tuple[int, float]
+
+
+def _value(v: Any) -> float:
+    # missing or odd values compare false against every threshold
+    try:
+        return math.nan if v is None else float(v)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def numeric_features(ctx: Dict[str, Any]) -> np.ndarray:
+    display, final = ctx["display"], ctx["final"]
+    feats = np.empty(N_FEATURES, dtype=np.float32)
+    feats[OP_DOMAIN_AGE_LT] = _value(ctx["sender"].get("domain_age_days"))
+    feats[OP_REPORTS_GTE] = _value(ctx["reputation"].get("reports_last_90d", 0))
+    feats[OP_BLACKLIST_EQ] = _value(ctx["reputation"].get("global_blacklist", False))
+    feats[OP_MULE_EQ] = _value(ctx["sender"].get("confirmed_mule", False))
+    feats[OP_URL_MISMATCH] = float(bool(display and final and display != final))
+    return feats
+
+
+def _compile_leaf(cond: Dict[str, Any], handlers: Dict[str, Any]) -> Optional[Leaf]:
+    # mirrors RuleEngine.compile_conditions: the first key with a handler wins
+    for key, val in cond.items():
+        if key in handlers:
+            if key not in NUMERIC_CONDITIONS:
+                return None
+            op, threshold = NUMERIC_CONDITIONS[key]
+            return op, threshold(val)
+    return None
+
+
+def compile_numeric(conds: Dict[str, Any], handlers: Dict[str, Any]) -> Optional[Tuple[bool, List[Leaf]]]:
+    """
+    Return (is_all, leaves) when a rule's conditions are a single numeric
+    check or an any/all list of them, else None (the rule stays on the
+    Python path).
+    """
+    if "any" in conds or "all" in conds:
+        is_all = "any" not in conds
+        leaves = []
+        for c in conds["all" if is_all else "any"]:
+            leaf = _compile_leaf(c, handlers) if isinstance(c, dict) else None
+            if leaf is None:
+                return None
+            leaves.append(leaf)
+        return is_all, leaves
+    leaf = _compile_leaf(conds, handlers)
+    return None if leaf is None else (True, [leaf])
+
+
+@njit(cache=True)
+def eval_numeric(feats, leaf_rule, leaf_op, leaf_thr, rule_all, fired):
+    for r in range(fired.shape[0]):
+        fired[r] = rule_all[r]
+    for k in range(leaf_op.shape[0]):
+        op = leaf_op[k]
+        x = feats[op]
+        t = leaf_thr[k]
+        if op == OP_DOMAIN_AGE_LT:
+            ok = x < t
+        elif op == OP_REPORTS_GTE:
+            ok = x >= t
+        else:
+            ok = x == t
+        r = leaf_rule[k]
+        if rule_all[r]:
+            fired[r] = fired[r] and ok
+        else:
+            fired[r] = fired[r] or ok
+    return fired
+
+
+class NumericRuleSet:
+    """Numeric-only rules packed into arrays for eval_numeric()."""
+
+    def __init__(self, rules: List[Tuple[bool, List[Leaf]]]):
+        leaf_rule, leaf_op, leaf_thr = [], [], []
+        for r, (_, leaves) in enumerate(rules):
+            for op, thr in leaves:
+                leaf_rule.append(r)
+                leaf_op.append(op)
+                leaf_thr.append(thr)
+        self.rule_all = np.array([is_all for is_all, _ in rules], dtype=np.bool_)
+        self.leaf_rule = np.array(leaf_rule, dtype=np.int32)
+        self.leaf_op = np.array(leaf_op, dtype=np.int32)
+        self.leaf_thr = np.array(leaf_thr, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.rule_all)
+
+    def evaluate(self, ctx: Dict[str, Any]) -> np.ndarray:
+        fired = np.empty(len(self.rule_all), dtype=np.bool_)
+        if len(fired):
+            eval_numeric(numeric_features(ctx), self.leaf_rule, self.leaf_op, self.leaf_thr, self.rule_all, fired)
+        return fired
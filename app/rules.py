@@ -1,7 +1,22 @@
-import math, yaml, re
-from typing import Dict, Any, List, Tuple, Callable
+import logging, math, os, tempfile, threading, yaml, re
+import orjson
+import re2
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Callable, FrozenSet
 from dataclasses import dataclass
-from .feature_extractors import contains_any, lookalike_score, regex_match
+from .feature_extractors import ML_TERMS, TermMatcher, as_context, build_matcher, scan_terms, domain_similarity
+from .numeric_rules import HAVE_NUMBA, NumericRuleSet, compile_numeric
+
+__all__ = [
+    "TIERS", "SATURATION_WEIGHT", "map_to_tier",
+    "diminishing_sum", "diminishing_sum_from_total", "blend_scores", "RuleHit", "CompiledRule", "CompiledRuleSet", "RuleEngine", "compile_pattern",
+]
+
+logger = logging.getLogger(__name__)
+
+try:
+    from yaml import CSafeLoader as YamlLoader  # libyaml-backed, much faster
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
 
 # Default tier boundaries
 TIERS: List[Tuple[str, int, int]] = [
@@ -17,134 +32,335 @@ def map_to_tier(score: float, tiers: List[Tuple[str, int, int]] = TIERS) -> str:
             return name
     return "T3" if score > 100 else "T0"
 
-def diminishing_sum(weights: List[float], cap: bool = True) -> float:
-    """Combine rule weights with diminishing returns, capped at 100 by default."""
-    total = sum(weights)
+# diminishing_sum() is within 0.1 of 100 once the total weight reaches this,
+# so apply() stops evaluating further rules (the score is an approximation past it)
+SATURATION_WEIGHT = 700.0
+
+# One kernel call costs about as much as ~8 numeric Python predicates, so it
+# only pays off for larger rule sets (and only when numba compiles it)
+NUMERIC_KERNEL_MIN_RULES = 16
+
+def diminishing_sum_from_total(total: float, cap: bool = True) -> float:
+    """Diminishing-returns score for an already summed rule weight, capped at 100 by default."""
     score = 100.0 * (1.0 - math.exp(-total / 100.0))
     return min(score, 100.0) if cap else score
 
+def diminishing_sum(weights: Iterable[float], cap: bool = True) -> float:
+    """Combine rule weights with diminishing returns, capped at 100 by default."""
+    return diminishing_sum_from_total(sum(weights), cap)
+
 @dataclass
 class RuleHit:
     rule_id: str
     weight: float
     evidence: Dict[str, Any]
 
+Condition = Callable[[Dict[str, Any]], Tuple[bool, Dict[str, Any]]]
+
+@dataclass
+class CompiledRule:
+    rule_id: str
+    weight: float
+    hard_stop: bool
+    predicate: Condition
+    # (is_all, [(op, threshold), ...]) when the rule only has numeric checks
+    numeric: Optional[Tuple[bool, List[Tuple[int, float]]]] = None
+
+@dataclass(frozen=True)
+class CompiledRuleSet:
+    """
+    Everything apply() reads for one version of the rules, stored column-wise
+    (parallel tuples, evaluation order). load_rules() swaps in a new instance
+    with a single assignment, so a reload never mixes old and new rules.
+    """
+    rules: Tuple[Dict[str, Any], ...] = ()
+    matcher: Optional[TermMatcher] = None
+    ids: Tuple[str, ...] = ()
+    weights: Tuple[float, ...] = ()
+    hard_stops: Tuple[bool, ...] = ()
+    predicates: Tuple[Condition, ...] = ()
+    # index into numeric for numeric-only rules, -1 for the rest
+    numeric_slots: Tuple[int, ...] = ()
+    numeric: Optional[NumericRuleSet] = None
+
+def compile_pattern(pattern: str):
+    """Compile with RE2 (linear time); fall back to Python re for patterns RE2 rejects, e.g. backreferences."""
+    try:
+        return re2.compile(pattern)
+    except re2.error:
+        logger.warning("RE2 rejected pattern %r, falling back to Python re", pattern)
+        return re.compile(pattern)
+
+def _never(ctx: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    return False, {}
+
+def _gated(slot: int, predicate: Condition) -> Condition:
+    # the kernel already decided the rule; the predicate only runs to build evidence
+    def cond(ctx):
+        if not ctx["numeric_fired"][slot]:
+            return False, {}
+        return predicate(ctx)
+    return cond
+
 class RuleEngine:
-    def __init__(self, rules_path: str):
+    def __init__(self, rules_path: str, cache_dir: Optional[str] = None):
         self.rules_path = rules_path
-        self.rules: List[Dict[str, Any]] = []
-        self.condition_handlers: Dict[str, Callable[[Any, Dict[str, Any]], Tuple[bool, Dict[str, Any]]]] = {
-            "text.contains_any": self._cond_contains_any,
-            "text.regex": self._cond_regex,
-            "url.display_domain_neq_final": self._cond_domain_mismatch,
-            "url.lookalike_threshold": self._cond_lookalike,
-            "sender.domain_age_lt_days": self._cond_domain_age,
-            "reputation.reports_last_90d_gte": self._cond_reports,
-            "reputation.global_blacklist": self._cond_blacklist,
-            "sender.confirmed_mule": self._cond_mule,
-        }
+        # parse cache goes next to the YAML unless a directory is given
+        self.cache_dir = cache_dir
+        self._rule_set = CompiledRuleSet(matcher=build_matcher({}))
+        self._term_groups: Dict[str, FrozenSet[str]] = {}
+        self._load_lock = threading.Lock()  # compiling fills self._term_groups
         self.load_rules()
 
+    # read-only copies from the current rule set (apply() uses the snapshot directly)
+    rules = property(lambda self: list(self._rule_set.rules))
+    matcher = property(lambda self: self._rule_set.matcher)
+    ids = property(lambda self: list(self._rule_set.ids))
+    weights = property(lambda self: list(self._rule_set.weights))
+    hard_stops = property(lambda self: list(self._rule_set.hard_stops))
+    predicates = property(lambda self: list(self._rule_set.predicates))
+    numeric_slots = property(lambda self: list(self._rule_set.numeric_slots))
+    numeric = property(lambda self: self._rule_set.numeric)
+
     def load_rules(self):
+        with self._load_lock:
+            self._rule_set = self._compile_rule_set()
+
+    def _compile_rule_set(self) -> CompiledRuleSet:
         try:
-            with open(self.rules_path, "r", encoding="utf-8") as f:
-                data = yaml.safe_load(f) or {}
+            data = self._read_rules_file()
             # ✅ Only keep the rules list
-            self.rules = data.get("rules", [])
+            rules = data.get("rules", [])
+            # the ML keyword tags ride along, so one scan serves rules and ML features
+            self._term_groups = {tag: frozenset(terms) for tag, terms in ML_TERMS.items()}
+            compiled = [self.compile_rule(r) for r in rules if isinstance(r, dict)]
+            # hard stops first, then heaviest rules, so apply() can stop early
+            compiled.sort(key=lambda c: (not c.hard_stop, -c.weight))
+            # every text.contains_any term goes into one matcher, tagged by condition
+            matcher = build_matcher(self._term_groups)
         except Exception as e:
             raise RuntimeError(f"Failed to load rules from {self.rules_path}: {e}")
+        numeric = [c.numeric for c in compiled if c.numeric is not None]
+        slots = iter(range(len(numeric)))
+        numeric_slots = tuple(-1 if c.numeric is None else next(slots) for c in compiled)
+        if HAVE_NUMBA and len(numeric) >= NUMERIC_KERNEL_MIN_RULES:
+            kernel = NumericRuleSet(numeric)
+            predicates = tuple(
+                c.predicate if slot < 0 else _gated(slot, c.predicate)
+                for c, slot in zip(compiled, numeric_slots)
+            )
+        else:
+            kernel = None
+            predicates = tuple(c.predicate for c in compiled)
+        return CompiledRuleSet(
+            rules=tuple(rules),
+            matcher=matcher,
+            ids=tuple(c.rule_id for c in compiled),
+            weights=tuple(c.weight for c in compiled),
+            hard_stops=tuple(c.hard_stop for c in compiled),
+            predicates=predicates,
+            numeric_slots=numeric_slots,
+            numeric=kernel,
+        )
+
+    @property
+    def cache_path(self) -> str:
+        # keep the full file name so rules.yaml and rules.yml get separate caches
+        cache_dir = self.cache_dir or os.path.dirname(self.rules_path)
+        return os.path.join(cache_dir, os.path.basename(self.rules_path) + ".cache.json")
+
+    def _read_rules_file(self) -> Dict[str, Any]:
+        """
+        Parse the YAML rule file, going through a JSON sidecar cache that is
+        reused for as long as the YAML file's path, size and mtime are unchanged.
+        """
+        st = os.stat(self.rules_path)
+        key = {
+            "source_path": os.path.abspath(self.rules_path),
+            "source_size": st.st_size,
+            "source_mtime_ns": st.st_mtime_ns,
+        }
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached = orjson.loads(f.read())
+            if all(cached.get(k) == v for k, v in key.items()):
+                return cached["data"]
+        except (OSError, orjson.JSONDecodeError, AttributeError, KeyError):
+            pass
+
+        with open(self.rules_path, "r", encoding="utf-8") as f:
+            data = yaml.load(f, Loader=YamlLoader) or {}
+        # write to a temp file and rename so readers never see a partial cache
+        try:
+            payload = orjson.dumps({**key, "data": data})
+            # YAML types JSON can't hold (e.g. dates) would come back changed
+            if orjson.loads(payload)["data"] != data:
+                logger.info("Rules in %s do not round-trip through JSON, not caching", self.rules_path)
+                return data
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.cache_path) or ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                # mkstemp creates 0600; workers running as another user must be able to read it
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, self.cache_path)
+            except OSError:
+                os.unlink(tmp)
+                raise
+        except (OSError, orjson.JSONEncodeError):
+            logger.warning("Could not write rules cache %s", self.cache_path)
+        return data
 
     # ---- Condition primitives ----
-    def _cond_contains_any(self, text: str, values: List[str]):
-        hits = contains_any(text, set(values))
-        return (bool(hits), {"matched_terms": hits} if hits else {})
-
-    def _cond_regex(self, text: str, pattern: str):
-        ok = re.search(pattern, text or "") is not None
-        return (ok, {"regex": pattern} if ok else {})
-
-    def _cond_domain_mismatch(self, event: Dict[str, Any], _):
-        display, final = event.get("display_domain"), event.get("final_domain")
-        ok = bool(display and final and display != final)
-        return (ok, {"display_domain": display, "final_domain": final} if ok else {})
-
-    def _cond_lookalike(self, event: Dict[str, Any], threshold: float):
-        display, final = event.get("display_domain"), event.get("final_domain")
-        score = lookalike_score(display, final)
-        ok = score >= float(threshold)
-        return (ok, {"lookalike_score": round(score, 2)} if ok else {})
-
-    def _cond_domain_age(self, event: Dict[str, Any], max_days: int):
-        days = (event.get("sender") or {}).get("domain_age_days")
-        ok = days is not None and days < int(max_days)
-        return (ok, {"domain_age_days": days} if ok else {})
-
-    def _cond_reports(self, event: Dict[str, Any], threshold: int):
-        rep = event.get("reputation", {}) or {}
-        count = rep.get("reports_last_90d", 0)
-        ok = count >= int(threshold)
-        return (ok, {"reports_last_90d": count} if ok else {})
-
-    def _cond_blacklist(self, event: Dict[str, Any], expected: bool):
-        rep = event.get("reputation", {}) or {}
-        actual = rep.get("global_blacklist", False)
-        ok = actual == bool(expected)
-        return (ok, {"global_blacklist": actual} if ok else {})
-
-    def _cond_mule(self, event: Dict[str, Any], expected: bool):
-        sender = event.get("sender", {}) or {}
-        actual = sender.get("confirmed_mule", False)
-        ok = actual == bool(expected)
-        return (ok, {"confirmed_mule": actual} if ok else {})
+    # Each primitive is called once at load time with the YAML value and
+    # returns a closure over the pre-processed value, so per-event work is
+    # limited to the check itself. Evidence is only built on a match.
+    def _cond_contains_any(self, values: List[str]) -> Condition:
+        tag = f"c{len(self._term_groups)}"
+        self._term_groups[tag] = frozenset(str(v).lower() for v in values)
+        def cond(ctx):
+            hits = ctx["term_hits"].get(tag)
+            return (bool(hits), {"matched_terms": hits} if hits else {})
+        return cond
 
-    # ---- Evaluation ----
-    def eval_conditions(self, event: Dict[str, Any], conds: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
+    def _cond_regex(self, pattern: str) -> Condition:
+        compiled = compile_pattern(pattern)
+        def cond(ctx):
+            ok = compiled.search(ctx["text"]) is not None
+            return (ok, {"regex": pattern} if ok else {})
+        return cond
+
+    def _cond_domain_mismatch(self, _) -> Condition:
+        def cond(ctx):
+            display, final = ctx["display"], ctx["final"]
+            ok = bool(display and final and display != final)
+            return (ok, {"display_domain": display, "final_domain": final} if ok else {})
+        return cond
+
+    def _cond_lookalike(self, threshold: float) -> Condition:
+        threshold = float(threshold)
+        def cond(ctx):
+            score = domain_similarity(ctx["display"], ctx["final"])
+            ok = score >= threshold
+            return (ok, {"lookalike_score": round(score, 2)} if ok else {})
+        return cond
+
+    def _cond_domain_age(self, max_days: int) -> Condition:
+        max_days = int(max_days)
+        def cond(ctx):
+            days = ctx["sender"].get("domain_age_days")
+            ok = days is not None and days < max_days
+            return (ok, {"domain_age_days": days} if ok else {})
+        return cond
+
+    def _cond_reports(self, threshold: int) -> Condition:
+        threshold = int(threshold)
+        def cond(ctx):
+            count = ctx["reputation"].get("reports_last_90d", 0)
+            ok = count >= threshold
+            return (ok, {"reports_last_90d": count} if ok else {})
+        return cond
+
+    def _cond_blacklist(self, expected: bool) -> Condition:
+        expected = bool(expected)
+        def cond(ctx):
+            actual = ctx["reputation"].get("global_blacklist", False)
+            ok = actual == expected
+            return (ok, {"global_blacklist": actual} if ok else {})
+        return cond
+
+    def _cond_mule(self, expected: bool) -> Condition:
+        expected = bool(expected)
+        def cond(ctx):
+            actual = ctx["sender"].get("confirmed_mule", False)
+            ok = actual == expected
+            return (ok, {"confirmed_mule": actual} if ok else {})
+        return cond
+
+    # Shared by all instances; entries are plain functions taking (self, value)
+    condition_handlers: Dict[str, Callable[[Any, Any], Condition]] = {
+        "text.contains_any": _cond_contains_any,
+        "text.regex": _cond_regex,
+        "url.display_domain_neq_final": _cond_domain_mismatch,
+        "url.lookalike_threshold": _cond_lookalike,
+        "sender.domain_age_lt_days": _cond_domain_age,
+        "reputation.reports_last_90d_gte": _cond_reports,
+        "reputation.global_blacklist": _cond_blacklist,
+        "sender.confirmed_mule": _cond_mule,
+    }
+
+    # ---- Compilation ----
+    def compile_rule(self, rule: Dict[str, Any]) -> CompiledRule:
+        conds = rule.get("conditions", {})
+        return CompiledRule(
+            rule_id=rule["id"],
+            weight=float(rule.get("weight", 0)),
+            hard_stop=bool(rule.get("hard_stop", False)),
+            predicate=self.compile_conditions(conds),
+            numeric=compile_numeric(conds, self.condition_handlers),
+        )
+
+    def compile_conditions(self, conds: Dict[str, Any]) -> Condition:
         if "any" in conds:
-            for c in conds["any"]:
-                ok, ev = self.eval_condition(event, c)
-                if ok:
-                    return True, ev
-            return False, {}
+            children = [self.compile_conditions(c) for c in conds["any"]]
+            def any_of(ctx):
+                for child in children:
+                    ok, ev = child(ctx)
+                    if ok:
+                        return True, ev
+                return False, {}
+            return any_of
         if "all" in conds:
-            combined = {}
-            for c in conds["all"]:
-                ok, ev = self.eval_condition(event, c)
-                if not ok:
-                    return False, {}
-                combined.update(ev)
-            return True, combined
-        return self.eval_condition(event, conds)
-
-    def eval_condition(self, event: Dict[str, Any], cond: Dict[str, Any]) -> Tuple[bool, Dict[str, Any]]:
-        text = event.get("text") or ""
-        for key, val in cond.items():
+            children = [self.compile_conditions(c) for c in conds["all"]]
+            def all_of(ctx):
+                combined = {}
+                for child in children:
+                    ok, ev = child(ctx)
+                    if not ok:
+                        return False, {}
+                    combined.update(ev)
+                return True, combined
+            return all_of
+        for key, val in conds.items():
             if key in self.condition_handlers:
-                handler = self.condition_handlers[key]
-                # some handlers need text, others need event
-                if key.startswith("text."):
-                    return handler(text, val)
-                return handler(event, val)
-        return False, {}
+                return self.condition_handlers[key](self, val)
+        return _never
+
+    # ---- Evaluation ----
+    def scan(self, ctx: Dict[str, Any]) -> Dict[str, List[str]]:
+        """Scan the text once for all contains_any terms and ML keywords; stored as ctx["term_hits"]."""
+        ctx["term_hits"] = scan_terms(ctx["text_lower"], self._rule_set.matcher)
+        return ctx["term_hits"]
 
     def apply(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Evaluate all rules against a raw event or a context from build_context()."""
+        ctx = as_context(event)
+        # one snapshot for the whole evaluation; a concurrent reload swaps in a new one
+        rs = self._rule_set
+        ctx["term_hits"] = scan_terms(ctx["text_lower"], rs.matcher)
+        if rs.numeric is not None:
+            # numeric-only rules are decided in one pass by the JIT kernel
+            ctx["numeric_fired"] = rs.numeric.evaluate(ctx)
+        ids, weights, hard_stops = rs.ids, rs.weights, rs.hard_stops
+        # rules are ordered by weight, so hits come out heaviest first
         hits: List[RuleHit] = []
         hard_stop = False
-        for r in self.rules:
-            if not isinstance(r, dict):  # ✅ skip bad entries
+        total = 0.0
+        for i, predicate in enumerate(rs.predicates):
+            ok, ev = predicate(ctx)
+            if not ok:
                 continue
-            ok, ev = self.eval_conditions(event, r.get("conditions", {}))
-            if ok:
-                rh = RuleHit(
-                    rule_id=r["id"],
-                    weight=float(r.get("weight", 0)),
-                    evidence=ev
-                )
-                hits.append(rh)
-                if r.get("hard_stop", False):
-                    hard_stop = True
-
-        weights = [h.weight for h in hits]
-        expert_score = diminishing_sum(weights)
+            w = weights[i]
+            hits.append(RuleHit(rule_id=ids[i], weight=w, evidence=ev))
+            total += w
+            if hard_stops[i]:
+                # the final score is forced to 100 anyway
+                hard_stop = True
+                break
+            if total >= SATURATION_WEIGHT:
+                break
+
+        expert_score = diminishing_sum_from_total(total)
         tier = map_to_tier(expert_score)
 
         return {
@@ -4,6 +4,7 @@ from sklearn.linear_model import LogisticRegression
 BASE = os.path.dirname(os.path.dirname(__file__))
 DATA = os.path.join(BASE, "data", "toy_events.csv")
 OUT = os.path.join(BASE, "app", "model.pkl")
+NPZ_OUT = os.path.join(BASE, "app", "model.npz")  # weights only, loaded by the API
 
 def featurize(df: pd.DataFrame):
     X = pd.DataFrame({
@@ -11,7 +12,7 @@ def featurize(df: pd.DataFrame):
         "has_otp": df["text"].str.lower().str.contains("otp|one-time password", regex=True).astype(int),
         "has_seed": df["text"].str.lower().str.contains("seed phrase|private key|recovery phrase", regex=True).astype(int),
         "has_urgent": df["text"].str.lower().str.contains("urgent|immediately", regex=True).astype(int),
-        "url_mismatch": (df["display_domain"].fillna("") != df["final_domain"].fillna("")).astype(int),
+        "url_mismatch": (df["display_domain"].fillna("").str.lower() != df["final_domain"].fillna("").str.lower()).astype(int),
         "domain_age": df["sender_domain_age_days"].fillna(9999).astype(int),
         "reports": df["reports_last_90d"].fillna(0).astype(int),
         "blacklisted": df["global_blacklist"].fillna(False).astype(int),
@@ -30,7 +31,8 @@ def main():
     }
     with open(OUT, "wb") as f:
         pickle.dump(model, f)
-    print(f"Saved model to {OUT}")
+    np.savez(NPZ_OUT, coef=clf.coef_, intercept=clf.intercept_, order=np.array(model["feature_order"]))
+    print(f"Saved model to {OUT} and {NPZ_OUT}")
 
 if __name__ == "__main__":
     main()
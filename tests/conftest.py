@@ -0,0 +1,10 @@
+import os, shutil, tempfile
+
+def pytest_configure(config):
+    # the app serializes with ORJSONResponse on purpose; newer FastAPI flags it as deprecated
+    config.addinivalue_line("filterwarnings", "ignore:ORJSONResponse is deprecated")
+    # app.main builds its engine at import; keep its rules cache out of the source tree
+    if "RULES_CACHE_DIR" not in os.environ:
+        cache_dir = tempfile.mkdtemp(prefix="rules-cache-")
+        os.environ["RULES_CACHE_DIR"] = cache_dir
+        config.add_cleanup(lambda: shutil.rmtree(cache_dir, ignore_errors=True))
@@ -0,0 +1,73 @@
+from app.main import detect
+from app.models import DetectResponse, Event
+import asyncio, json, os
+
+def test_detect_matches_response_schema():
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "sample_event.json")) as f:
+        event = Event(**json.load(f))
+    resp = asyncio.run(detect(event))
+    # /detect skips validation when building the response, so check the shape here
+    checked = DetectResponse.model_validate_json(resp.body)
+    assert checked.tier == "T3"
+    assert checked.actions == ["block", "escalate_manual_review"]
+    assert checked.rule_hits and checked.rule_hits[0].rule_id == "R060"
+
+    resp = asyncio.run(detect(Event(text="lunch at noon?")))
+    checked = DetectResponse.model_validate_json(resp.body)
+    assert checked.tier == "T0" and checked.rule_hits == []
+
+def _write_model(tmp_path):
+    import pickle
+    import numpy as np
+    from sklearn.linear_model import LogisticRegression
+    from app.main import _FEATURES
+    order = list(_FEATURES)
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 30, size=(200, len(order)))
+    y = (X[:, 1] + X[:, 6] > 30).astype(int)
+    clf = LogisticRegression(max_iter=1000).fit(X, y)
+    pkl, npz = tmp_path / "model.pkl", tmp_path / "model.npz"
+    with open(pkl, "wb") as f:
+        pickle.dump({"clf": clf, "feature_order": order}, f)
+    np.savez(npz, coef=clf.coef_, intercept=clf.intercept_, order=np.array(order))
+    return clf, order, str(pkl), str(npz)
+
+def _reset_model(monkeypatch, pkl, npz, debug):
+    import app.main as m
+    for name in ("_ml_model", "_ml_ready", "_ml_warm", "_FEATURE_FILL", "_W", "_b"):
+        monkeypatch.setattr(m, name, getattr(m, name))
+    monkeypatch.setattr(m, "_ml_model", None)
+    monkeypatch.setattr(m, "_ml_ready", False)
+    monkeypatch.setattr(m, "_ml_warm", False)
+    monkeypatch.setattr(m, "MODEL_PATH", pkl)
+    monkeypatch.setattr(m, "MODEL_NPZ_PATH", npz)
+    monkeypatch.setattr(m, "ML_DEBUG", debug)
+
+def test_ml_fast_path_matches_predict_proba(tmp_path, monkeypatch):
+    import numpy as np
+    import pytest
+    import app.main as m
+    clf, order, pkl, npz = _write_model(tmp_path)
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "sample_event.json")) as f:
+        events = [json.load(f), {"text": "urgent: share your seed phrase", "display_domain": "A.com", "final_domain": "a.com"}]
+    expected = [clf.predict_proba([[m.featurize_for_ml(e)[k] for k in order]])[0][1] * 100.0 for e in events]
+
+    # lazy load from the npz alone (no pickle)
+    _reset_model(monkeypatch, str(tmp_path / "missing.pkl"), npz, False)
+    assert not m._ml_warm
+    got = [m.ml_score(e) for e in events]
+    assert m._ml_warm and m._ml_ready and m._ml_model is None
+    assert got == pytest.approx(expected, rel=1e-5)
+    rows = np.stack([m._fill_features(m.build_context(e), np.empty(len(order), np.float32)) for e in events])
+    assert list(m._score_rows(rows)) == pytest.approx(expected, rel=1e-5)
+
+    # pickle only
+    _reset_model(monkeypatch, pkl, str(tmp_path / "missing.npz"), False)
+    assert [m.ml_score(e) for e in events] == pytest.approx(expected, rel=1e-5)
+
+    # ML_DEBUG uses predict_proba when the pickle exists, and falls back to the npz otherwise
+    _reset_model(monkeypatch, pkl, npz, True)
+    assert [m.ml_score(e) for e in events] == pytest.approx(expected, rel=1e-12)
+    _reset_model(monkeypatch, str(tmp_path / "missing.pkl"), npz, True)
+    assert m._load_model()
+    assert [m.ml_score(e) for e in events] == pytest.approx(expected, rel=1e-5)
@@ -0,0 +1,67 @@
+from app.batching import MLBatcher
+import asyncio
+import numpy as np
+
+def test_batcher_coalesces_concurrent_calls():
+    sizes = []
+    def score_rows(xs):
+        sizes.append(len(xs))
+        return xs.sum(axis=1)
+    def score_one(x):
+        sizes.append(1)
+        return float(x.sum())
+
+    async def run():
+        batcher = MLBatcher(score_rows, score_one, max_batch=8, max_wait_ms=20)
+        batcher.start()
+        async def request(row):
+            with batcher.track():
+                await asyncio.sleep(0)  # let every request start before any scores
+                return await batcher.score(row)
+        rows = [np.full(3, i, np.float32) for i in range(10)]
+        scores = await asyncio.gather(*(request(r) for r in rows))
+        await batcher.stop()
+        return scores
+
+    assert asyncio.run(run()) == [3.0 * i for i in range(10)]
+    assert sizes == [8, 2]
+
+def test_batcher_scores_inline_when_not_started():
+    batcher = MLBatcher(lambda xs: xs.sum(axis=1), lambda x: float(x.sum()))
+    assert asyncio.run(batcher.score(np.ones(4, np.float32))) == 4.0
+
+def test_batcher_does_not_delay_lone_request():
+    async def run():
+        batcher = MLBatcher(lambda xs: xs.sum(axis=1), lambda x: float(x.sum()), max_wait_ms=500)
+        batcher.start()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with batcher.track():
+            score = await batcher.score(np.ones(4, np.float32))
+        elapsed = loop.time() - start
+        await batcher.stop()
+        return score, elapsed
+
+    score, elapsed = asyncio.run(run())
+    assert score == 4.0 and elapsed < 0.1
+
+def test_batcher_stops_waiting_when_other_requests_finish():
+    async def run():
+        batcher = MLBatcher(lambda xs: xs.sum(axis=1), lambda x: float(x.sum()), max_wait_ms=500)
+        batcher.start()
+        loop = asyncio.get_running_loop()
+        async def scored():
+            with batcher.track():
+                await asyncio.sleep(0)
+                return await batcher.score(np.ones(4, np.float32))
+        async def unscored():  # e.g. a hard stop, which never reaches ML scoring
+            with batcher.track():
+                await asyncio.sleep(0.01)
+        start = loop.time()
+        score, _ = await asyncio.gather(scored(), unscored())
+        elapsed = loop.time() - start
+        await batcher.stop()
+        return score, elapsed
+
+    score, elapsed = asyncio.run(run())
+    assert score == 4.0 and elapsed < 0.1
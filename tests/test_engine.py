@@ -1,8 +1,9 @@
-from app.rules import RuleEngine, diminishing_sum, map_to_tier
-import os
+from app.rules import RuleEngine, compile_pattern, diminishing_sum, diminishing_sum_from_total, map_to_tier
+from app.feature_extractors import _cached_similarity, build_automaton, build_matcher, contains_any, domain_similarity, scan_terms
+import json, os
 
-def test_rule_load():
-    engine = RuleEngine(os.path.join(os.path.dirname(__file__), "..", "rules", "rules.yaml"))
+def test_rule_load(tmp_path):
+    engine = RuleEngine(os.path.join(os.path.dirname(__file__), "..", "rules", "rules.yaml"), cache_dir=str(tmp_path))
     assert len(engine.rules) > 0
 
 def test_diminishing_sum():
@@ -15,3 +16,140 @@ def test_tier_mapping():
     assert map_to_tier(30) == "T1"
     assert map_to_tier(60) == "T2"
     assert map_to_tier(90) == "T3"
+
+def test_apply_sample_event(tmp_path):
+    engine = RuleEngine(os.path.join(os.path.dirname(__file__), "..", "rules", "rules.yaml"), cache_dir=str(tmp_path))
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "sample_event.json")) as f:
+        event = json.load(f)
+    result = engine.apply(event)
+    # hard-stop rules are evaluated first and end evaluation
+    assert [h["rule_id"] for h in result["hits"]] == ["R060"]
+    assert result["hard_stop"] is True
+
+    event["reputation"] = {}
+    result = engine.apply(event)
+    assert {h["rule_id"] for h in result["hits"]} == {"R001", "R040", "R050"}
+    assert result["hard_stop"] is False
+    assert engine.apply({"text": "see you at lunch"})["hits"] == []
+
+def test_compile_pattern_falls_back_to_re():
+    assert compile_pattern(r"(?i)bit\.ly").search("see BIT.LY/x")
+    assert compile_pattern(r"(a)\1").search("xaax")
+
+def test_term_matchers_agree():
+    groups = {"a": ["otp", "seed phrase"], "b": ["don't tell", "otp"]}
+    text = "send the otp now and don't tell anyone about the otp"
+    expected = {"a": ["otp"], "b": ["otp", "don't tell"]}
+    assert scan_terms(text, build_automaton(groups)) == expected
+    assert scan_terms(text, build_matcher(groups)) == expected
+    assert scan_terms(text, build_matcher({})) == {}
+    # builders lowercase terms themselves; scanned text is always lowercase
+    assert scan_terms(text, build_matcher({"a": ["OTP"]})) == {"a": ["otp"]}
+    assert contains_any("Send the OTP", frozenset({"otp", "seed phrase"})) == ["otp"]
+
+def test_diminishing_sum_from_total():
+    assert diminishing_sum_from_total(75) == diminishing_sum([45, 30])
+    assert diminishing_sum_from_total(0) == 0.0
+
+def test_rules_cache_invalidated_on_change(tmp_path):
+    rules = tmp_path / "rules.yaml"
+    rules.write_text("rules:\n  - id: A\n    conditions: {text.contains_any: [foo]}\n    weight: 10\n")
+    engine = RuleEngine(str(rules))
+    assert os.path.exists(engine.cache_path)
+    assert RuleEngine(str(rules)).ids == ["A"]
+
+    rules.write_text("rules:\n  - id: B\n    conditions: {text.contains_any: [bar]}\n    weight: 10\n")
+    os.utime(rules, ns=(0, os.stat(rules).st_mtime_ns + 1))
+    engine.load_rules()
+    assert engine.ids == ["B"]
+    assert os.stat(engine.cache_path).st_mode & 0o777 == 0o644
+
+def test_rules_cache_location(tmp_path):
+    body = "rules:\n  - id: A\n    conditions: {text.contains_any: [foo]}\n    weight: 10\n"
+    (tmp_path / "rules.yaml").write_text(body)
+    (tmp_path / "rules.yml").write_text(body.replace("id: A", "id: B"))
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    a = RuleEngine(str(tmp_path / "rules.yaml"), cache_dir=str(cache_dir))
+    b = RuleEngine(str(tmp_path / "rules.yml"), cache_dir=str(cache_dir))
+    assert a.cache_path != b.cache_path and os.path.dirname(a.cache_path) == str(cache_dir)
+    assert RuleEngine(str(tmp_path / "rules.yaml"), cache_dir=str(cache_dir)).ids == ["A"]
+    assert RuleEngine(str(tmp_path / "rules.yml"), cache_dir=str(cache_dir)).ids == ["B"]
+
+def test_rules_cache_skipped_when_not_json_safe(tmp_path):
+    import datetime
+    rules = tmp_path / "rules.yaml"
+    rules.write_text("updated: 2024-01-02\nrules: []\n")
+    engine = RuleEngine(str(rules))
+    assert not os.path.exists(engine.cache_path)
+    assert RuleEngine(str(rules)).rules == [] and engine._read_rules_file()["updated"] == datetime.date(2024, 1, 2)
+
+def test_numeric_rules(tmp_path, monkeypatch):
+    import app.rules
+    path = os.path.join(os.path.dirname(__file__), "..", "rules", "rules.yaml")
+    engine = RuleEngine(path, cache_dir=str(tmp_path))
+    assert sorted(engine.ids[i] for i, s in enumerate(engine.numeric_slots) if s >= 0) == ["R060", "R999"]
+    # two numeric rules are below the threshold where the kernel pays off
+    assert engine.numeric is None
+
+    monkeypatch.setattr(app.rules, "HAVE_NUMBA", True)  # the kernel also runs as plain Python
+    monkeypatch.setattr(app.rules, "NUMERIC_KERNEL_MIN_RULES", 1)
+    kernel = RuleEngine(path, cache_dir=str(tmp_path))
+    assert kernel.numeric is not None and len(kernel.numeric) == 2
+
+    events = [
+        {"sender": {"confirmed_mule": True}},
+        {"reputation": {"global_blacklist": True}},
+        {"reputation": {"reports_last_90d": 3}},
+        {"reputation": {"reports_last_90d": 2, "global_blacklist": None}},
+        {"text": "send your otp", "sender": {"domain_age_days": 3}},
+    ]
+    for event in events:
+        assert kernel.apply(dict(event)) == engine.apply(dict(event))
+    def hit_ids(**event):
+        return [h["rule_id"] for h in kernel.apply(event)["hits"]]
+    assert hit_ids(sender={"confirmed_mule": True}) == ["R999"]
+    assert hit_ids(reputation={"global_blacklist": True}) == ["R060"]
+    assert hit_ids(reputation={"reports_last_90d": 3}) == ["R060"]
+    assert hit_ids(reputation={"reports_last_90d": 2, "global_blacklist": None}) == []
+
+def test_contains_any_terms_lowercased_at_load(tmp_path):
+    rules = tmp_path / "rules.yaml"
+    rules.write_text("rules:\n  - id: A\n    conditions: {text.contains_any: [Gift Card, OTP]}\n    weight: 10\n")
+    hits = RuleEngine(str(rules)).apply({"text": "Buy a GIFT CARD now"})["hits"]
+    assert hits == [{"rule_id": "A", "weight": 10.0, "evidence": {"matched_terms": ["gift card"]}}]
+
+def test_domain_similarity_skips_cache_for_oversized_domains():
+    _cached_similarity.cache_clear()
+    assert domain_similarity("paypai.com", "paypal.com") == _cached_similarity("paypai.com", "paypal.com")
+    long_a, long_b = "a" * 10_000 + ".com", "b" * 10_000 + ".com"
+    assert 0.0 <= domain_similarity(long_a, long_b) < 1.0
+    assert _cached_similarity.cache_info().currsize == 1
+
+def test_reload_never_mixes_rule_sets(tmp_path):
+    import threading
+    a, b = tmp_path / "a.yaml", tmp_path / "b.yaml"
+    a.write_text("rules:\n  - id: A1\n    conditions: {text.contains_any: [alpha]}\n    weight: 10\n")
+    b.write_text("rules:\n" + "".join(
+        f"  - id: B{i}\n    conditions: {{text.contains_any: [beta{i}]}}\n    weight: {10 + i}\n" for i in range(1, 4)
+    ))
+    engine = RuleEngine(str(a), cache_dir=str(tmp_path))
+    stop = threading.Event()
+    def reload():
+        paths = [str(b), str(a)]
+        for i in range(300):
+            engine.rules_path = paths[i % 2]
+            engine.load_rules()
+        stop.set()
+    t = threading.Thread(target=reload)
+    t.start()
+    text = "alpha beta1 beta2 beta3"
+    seen = 0
+    while not stop.is_set():
+        for hit in engine.apply({"text": text})["hits"]:
+            # each id must come with the evidence of its own predicate
+            expected = "alpha" if hit["rule_id"] == "A1" else "beta" + hit["rule_id"][1:]
+            assert hit["evidence"] == {"matched_terms": [expected]}
+            seen += 1
+    t.join()
+    assert seen